@@ -1,13 +1,55 @@
 import os
+from dataclasses import dataclass, field
+from functools import cache
+from types import MappingProxyType
 from typing import Optional
 
+# Waste categories configuration (read-only all the way down)
+WASTE_CATEGORIES = MappingProxyType({name: MappingProxyType(info) for name, info in {
+    "recyclable": {
+        "icon": "♻️",
+        "color": "#34C759",
+        "description": "Paper, glass, metals, and certain plastics"
+    },
+    "compostable": {
+        "icon": "🌿",
+        "color": "#30B48D",
+        "description": "Food scraps, yard waste, organic materials"
+    },
+    "landfill": {
+        "icon": "🗑️",
+        "color": "#FF9500",
+        "description": "Non-recyclable, non-hazardous waste"
+    },
+    "hazardous": {
+        "icon": "⚠️",
+        "color": "#FF3B30",
+        "description": "Batteries, chemicals, paint, toxic materials"
+    },
+    "e-waste": {
+        "icon": "💻",
+        "color": "#5856D6",
+        "description": "Electronics, cables, appliances"
+    },
+    "textile": {
+        "icon": "👕",
+        "color": "#FF2D55",
+        "description": "Clothes, fabric, shoes"
+    }
+}.items()})
+
+# Levels accepted for LOG_LEVEL and --log-level
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+
+@dataclass(frozen=True, slots=True)
 class Settings:
-    """Application settings and configuration"""
+    """Application settings and configuration (immutable, see get_settings())"""
     
-    # Get API key from environment variable, fallback to hardcoded for local dev
-    NVIDIA_API_KEY: str = os.getenv(
+    # API key comes from the environment only; the app refuses to start without it
+    NVIDIA_API_KEY: Optional[str] = field(default_factory=lambda: os.getenv(
         "NVIDIA_API_KEY"
-    )
+    ))
     
     # API endpoint
     API_ENDPOINT: str = "https://integrate.api.nvidia.com/v1/chat/completions"
@@ -19,63 +61,50 @@ class Settings:
     
     # Server settings
     HOST: str = "0.0.0.0"
-    PORT: int = int(os.getenv("PORT", "8000"))
+    PORT: int = field(default_factory=lambda: int(os.getenv("PORT", "8000")))
+    
+    # Level for the greenguide logger; DEBUG adds per-step details
+    LOG_LEVEL: str = field(default_factory=lambda: os.getenv("LOG_LEVEL", "INFO").upper())
+    
+    # Uploads larger than this are rejected before being read
+    MAX_UPLOAD_BYTES: int = 10 * 1024 * 1024
     
     # CORS settings
-    CORS_ORIGINS: list = ["*"]  # In production, specify your iOS app domain
+    CORS_ORIGINS: tuple = ("*",)  # In production, specify your iOS app domain
     
-    # Waste categories configuration
-    WASTE_CATEGORIES = {
-        "recyclable": {
-            "icon": "♻️",
-            "color": "#34C759",
-            "description": "Paper, glass, metals, and certain plastics"
-        },
-        "compostable": {
-            "icon": "🌿",
-            "color": "#30B48D",
-            "description": "Food scraps, yard waste, organic materials"
-        },
-        "landfill": {
-            "icon": "🗑️",
-            "color": "#FF9500",
-            "description": "Non-recyclable, non-hazardous waste"
-        },
-        "hazardous": {
-            "icon": "⚠️",
-            "color": "#FF3B30",
-            "description": "Batteries, chemicals, paint, toxic materials"
-        },
-        "e-waste": {
-            "icon": "💻",
-            "color": "#5856D6",
-            "description": "Electronics, cables, appliances"
-        },
-        "textile": {
-            "icon": "👕",
-            "color": "#FF2D55",
-            "description": "Clothes, fabric, shoes"
-        }
-    }
+    # Waste categories configuration (read-only)
+    WASTE_CATEGORIES: MappingProxyType = field(default_factory=lambda: WASTE_CATEGORIES)
     
-    # Environmental impact metrics
-    IMPACT_METRICS = [
+    # Environmental impact metrics: ordered tuple for iteration and random
+    # selection, frozenset for O(1) membership checks
+    IMPACT_METRICS_ORDERED: tuple = (
         "co2_savings",
         "energy_savings",
         "water_conservation",
         "resource_conservation",
         "landfill_space_saved",
         "pollution_reduction"
-    ]
+    )
+    IMPACT_METRICS: frozenset = frozenset(IMPACT_METRICS_ORDERED)
     
     # Confidence thresholds
-    CONFIDENCE_HIGH = 0.85
-    CONFIDENCE_MEDIUM = 0.65
+    CONFIDENCE_HIGH: float = 0.85
+    CONFIDENCE_MEDIUM: float = 0.65
     
-    @classmethod
-    def validate(cls) -> bool:
+    def __post_init__(self):
+        # Fail at startup with the accepted values rather than deep inside logging
+        if self.LOG_LEVEL not in LOG_LEVELS:
+            raise ValueError(f"LOG_LEVEL must be one of {', '.join(LOG_LEVELS)}, got {self.LOG_LEVEL!r}")
+    
+    def validate(self) -> bool:
         """Check if required settings are configured"""
-        return bool(cls.NVIDIA_API_KEY and cls.NVIDIA_API_KEY.startswith("nvapi-"))
+        return bool(self.NVIDIA_API_KEY and self.NVIDIA_API_KEY.startswith("nvapi-"))
+
+
+@cache
+def get_settings() -> Settings:
+    """Return the process-wide Settings instance, reading the environment once"""
+    return Settings()
 
 
-settings = Settings()
\ No newline at end of file
+settings = get_settings()
\ No newline at end of file
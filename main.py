@@ -1,18 +1,205 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import asyncio
+import functools
+import hashlib
+import itertools
+import logging
+import queue
+from contextlib import asynccontextmanager, contextmanager
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-import base64
-import requests
-from io import BytesIO
-from PIL import Image
-import traceback
-import json
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import httpx
+import orjson
+from cachetools import LRUCache, TTLCache
+from collections import defaultdict
+from io import SEEK_END, BytesIO
+from logging.handlers import QueueHandler, QueueListener
+import re
 import random
-from config import settings
+import time
+from config import LOG_LEVELS, settings
+
+# pybase64 uses SIMD encoders where the CPU has them; the stdlib is the fallback
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# Leading bytes of the upload formats we accept
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+)
+SNIFF_BYTES = 32
+
+# Longest edge sent to the vision model
+MAX_IMAGE_SIZE = 1024
+JPEG_QUALITY = 85
+
+# Small JPEGs carrying any of these (GPS position, device details, editing
+# history) are re-encoded rather than sent to the API as uploaded
+JPEG_METADATA_KEYS = ("exif", "xmp", "photoshop", "comment")
+
+# Pillow first shrinks by a whole factor with a cheap box filter and only
+# runs LANCZOS on the last step, so large PNG/WEBP uploads cost one pass at
+# a fraction of full resolution (JPEGs already get this from draft()). The
+# default of 2.0 keeps more detail than the vision model needs
+RESIZE_REDUCING_GAP = 1.5
+
+# Uploads claiming more pixels than this are rejected from the header alone,
+# before Pillow or libvips decode anything (a 10MB file can easily claim far
+# more: decompression bombs). Leaves room for 48-50MP phone cameras
+MAX_IMAGE_PIXELS = 64 * 1024 * 1024
+
+# Gateway errors from the NVIDIA API are retried with exponential backoff
+RETRY_STATUS_CODES = frozenset({502, 503, 504})
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.3
+
+# Reasoning output is effectively deterministic per item; educator feedback
+# varies a little, so it expires after a day
+reasoning_cache = LRUCache(maxsize=1024)
+educator_cache = TTLCache(maxsize=10_000, ttl=86400)
+
+
+# Image fingerprints are 16x16 dHashes (see image_fingerprint); near-uniform
+# images have very few or very many bits set and all hash alike
+FINGERPRINT_BITS = 256
+MIN_FINGERPRINT_BITS = 16
+
+
+class FingerprintCache(TTLCache):
+    """
+    TTL cache keyed by image fingerprints that can also match near-duplicates
+    find() returns the entry whose key is within max_distance bits (Hamming
+    distance) of the query. Keys are split into max_distance + 1 bands, so any
+    match shares at least one band exactly and only those keys are compared
+    """
+    
+    def __init__(self, maxsize, ttl, max_distance, bits=FINGERPRINT_BITS, timer=time.monotonic):
+        super().__init__(maxsize, ttl, timer)
+        bands = max_distance + 1
+        widths = [bits // bands + (i < bits % bands) for i in range(bands)]
+        offsets = [sum(widths[:i]) for i in range(bands)]
+        self._bands = tuple((offset, (1 << width) - 1) for offset, width in zip(offsets, widths))
+        self._index = tuple(defaultdict(set) for _ in self._bands)
+        self.max_distance = max_distance
+    
+    def _band_keys(self, fingerprint):
+        return [(fingerprint >> offset) & mask for offset, mask in self._bands]
+    
+    def _unindex(self, fingerprint):
+        for index, band in zip(self._index, self._band_keys(fingerprint)):
+            keys = index.get(band)
+            if keys is not None:
+                keys.discard(fingerprint)
+                if not keys:
+                    del index[band]
+    
+    def __setitem__(self, fingerprint, value):
+        if fingerprint not in self:
+            for index, band in zip(self._index, self._band_keys(fingerprint)):
+                index[band].add(fingerprint)
+        super().__setitem__(fingerprint, value)
+    
+    def __delitem__(self, fingerprint):
+        # TTLCache raises KeyError after removing an expired key
+        try:
+            super().__delitem__(fingerprint)
+        finally:
+            self._unindex(fingerprint)
+    
+    def expire(self, time=None):
+        # TTLCache.expire() bypasses __delitem__, so unindex what it removed
+        expired = super().expire(time)
+        for fingerprint, _ in expired:
+            self._unindex(fingerprint)
+        return expired
+    
+    def clear(self):
+        super().clear()
+        for index in self._index:
+            index.clear()
+    
+    def find(self, fingerprint):
+        """Returns: (value, distance) for the closest cached fingerprint, or (None, None)"""
+        if fingerprint in self:
+            return self[fingerprint], 0
+        
+        best, best_distance = None, self.max_distance + 1
+        for index, band in zip(self._index, self._band_keys(fingerprint)):
+            for key in index.get(band, ()):
+                distance = (key ^ fingerprint).bit_count()
+                if distance < best_distance and key in self:
+                    best, best_distance = key, distance
+        if best is None:
+            return None, None
+        return self[best], best_distance
+
+
+# Full /classify responses keyed by image fingerprint, kept for an hour.
+# Different objects on the same background can be a single bit apart even at
+# 256 bits, so only an exact fingerprint match counts as the same image
+response_cache = FingerprintCache(maxsize=10_000, ttl=3600, max_distance=0)
+
+# Clients may reuse a response for the same image bytes (see the ETag header)
+ETAG_CACHE_CONTROL = "private, max-age=3600"
+HASH_CHUNK_BYTES = 1024 * 1024
+
+logger = logging.getLogger("greenguide")
+
+
+def setup_logging(level):
+    """
+    Route greenguide log records through a queue so the stdout write happens
+    on a background thread instead of in the request path
+    Returns: the QueueListener, which the caller starts and stops
+    """
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.handlers = [QueueHandler(log_queue)]
+    logger.setLevel(level)
+    logger.propagate = False
+    return QueueListener(log_queue, handler, respect_handler_level=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Check the API key, start background logging and create the shared NVIDIA
+    API client on startup; close the client and logging on shutdown
+    """
+    # Fail fast instead of sending unauthenticated calls to the API
+    if not settings.NVIDIA_API_KEY:
+        raise RuntimeError("NVIDIA_API_KEY environment variable is not set")
+    
+    # --log-level on the command line wins over the LOG_LEVEL setting
+    log_listener = setup_logging(getattr(app.state, "log_level", settings.LOG_LEVEL))
+    log_listener.start()
+    
+    # One pooled client for all model calls so keep-alive connections (and
+    # HTTP/2 streams) are reused instead of doing a TLS handshake per call.
+    # Transport-level retries cover connection failures only
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=MAX_RETRIES,
+        limits=httpx.Limits(max_connections=1000, max_keepalive_connections=200)
+    )
+    app.state.http_client = httpx.AsyncClient(transport=transport, timeout=60)
+    try:
+        yield
+    finally:
+        await app.state.http_client.aclose()
+        log_listener.stop()
+
 
 app = FastAPI(
     title="GreenGuide API",
     description="AI-powered waste classification and disposal advisor",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -25,36 +212,34 @@ app.add_middleware(
 )
 
 
-def encode_image_to_base64(image_bytes):
-    """Convert image bytes to base64 string"""
-    return base64.b64encode(image_bytes).decode('utf-8')
+# Static request parts shared by every model call, built once at import time
+API_HEADERS = {
+    "Authorization": f"Bearer {settings.NVIDIA_API_KEY}",
+    "Content-Type": "application/json"
+}
 
+DATA_URI_PREFIX = b"data:image/jpeg;base64,"
 
-def call_vision_model(image_base64):
-    """
-    Call NVIDIA Nemotron vision model to identify and validate the object
-    Returns: dict with is_waste_item, item_name, rejection_reason, confidence
-    """
-    headers = {
-        "Authorization": f"Bearer {settings.NVIDIA_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "model": settings.VISION_MODEL,
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": """You are a waste classification expert. Analyze this image carefully.
+CATEGORY_GUIDE = """1. recyclable - Clean paper, cardboard, glass bottles/jars, metal cans, plastic bottles/containers (#1-7)
+2. compostable - Food scraps, fruit/vegetable peels, coffee grounds, yard waste, paper napkins
+3. landfill - Contaminated items, mixed materials, chip bags, styrofoam, used napkins
+4. hazardous - Batteries, paint, chemicals, motor oil, pesticides, fluorescent bulbs
+5. e-waste - Electronics, phones, computers, cables, small appliances, chargers
+6. textile - Clothes, shoes, bags, fabric, towels, bedding"""
+
+# The vision model also categorizes the item and writes the feedback, so a
+# well-formed answer saves the reasoning and educator round-trips
+VISION_PROMPT = """You are a waste classification expert. Analyze this image carefully.
 
 First, determine if this is a waste/disposal item that someone would throw away or recycle.
 
 If YES (it's a waste item):
 - Identify the specific item (e.g., 'plastic water bottle', 'banana peel', 'AA battery', 'cotton t-shirt')
 - Be specific about material when possible (e.g., 'aluminum can' not just 'can')
+- Classify it into exactly one of these disposal categories:
+""" + CATEGORY_GUIDE + """
+- Provide 2-3 brief preparation steps if needed
+- Write environmental impact feedback about proper disposal of the item: start with the primary benefit, include a SPECIFIC, QUANTIFIED metric (e.g., "saves enough energy to charge your phone 500 times"), keep it under 3 sentences, and be encouraging and friendly, not preachy
 
 If NO (not a waste item):
 - Determine why: person, animal, landscape, building, multiple_items, unclear, food_on_plate, empty_image
@@ -64,101 +249,567 @@ Respond ONLY with JSON in this exact format:
   "is_waste_item": true or false,
   "item_name": "specific item name or null",
   "rejection_reason": "reason code or null",
-  "confidence": 0.0 to 1.0
+  "confidence": 0.0 to 1.0,
+  "category": "one of: recyclable, compostable, landfill, hazardous, e-waste, textile, or null",
+  "category_confidence": 0.0 to 1.0,
+  "preparation_steps": ["step 1", "step 2"],
+  "feedback": "environmental impact feedback or null"
 }
 
 Examples:
-- Plastic bottle → {"is_waste_item": true, "item_name": "plastic water bottle", "rejection_reason": null, "confidence": 0.95}
-- Person's face → {"is_waste_item": false, "item_name": null, "rejection_reason": "person", "confidence": 0.98}
-- Blurry image → {"is_waste_item": false, "item_name": null, "rejection_reason": "unclear", "confidence": 0.3}"""
+- Plastic bottle → {"is_waste_item": true, "item_name": "plastic water bottle", "rejection_reason": null, "confidence": 0.95, "category": "recyclable", "category_confidence": 0.9, "preparation_steps": ["Empty and rinse the bottle", "Place in recycling bin"], "feedback": "..."}
+- Person's face → {"is_waste_item": false, "item_name": null, "rejection_reason": "person", "confidence": 0.98, "category": null, "category_confidence": 0.0, "preparation_steps": [], "feedback": null}
+- Blurry image → {"is_waste_item": false, "item_name": null, "rejection_reason": "unclear", "confidence": 0.3, "category": null, "category_confidence": 0.0, "preparation_steps": [], "feedback": null}"""
+
+REASONING_SYSTEM_PROMPT = """You are a waste management expert. Classify items into these categories:
+
+""" + CATEGORY_GUIDE + """
+
+Provide 2-3 brief preparation steps if needed."""
+
+# Words the reasoning model may use for each disposal category
+CATEGORY_ALIASES = {
+    "recyclable": "recyclable",
+    "recycle": "recyclable",
+    "recycling": "recyclable",
+    "compostable": "compostable",
+    "compost": "compostable",
+    "composting": "compostable",
+    "landfill": "landfill",
+    "trash": "landfill",
+    "hazardous": "hazardous",
+    "e-waste": "e-waste",
+    "ewaste": "e-waste",
+    "electronic": "e-waste",
+    "electronics": "e-waste",
+    "textile": "textile",
+    "textiles": "textile",
+    "fabric": "textile"
+}
+
+# The category_info block of the /classify response, built once per category.
+# Responses share these dicts, so they must not be modified
+CATEGORY_INFO = {
+    name: {
+        "name": name,
+        "icon": info.get("icon", "🗑️"),
+        "color": info.get("color", "#FF9500"),
+        "description": info.get("description", "")
+    }
+    for name, info in settings.WASTE_CATEGORIES.items()
+}
+
+WORD_RE = re.compile(r"[a-z]+(?:-[a-z]+)*")
+
+# Markdown code fence some models wrap their JSON in
+FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+# Words in an item name that usually give away its category; used to guess
+# the category so the educator call can start while the reasoning model runs
+CATEGORY_HINTS = {
+    "bottle": "recyclable",
+    "can": "recyclable",
+    "cardboard": "recyclable",
+    "carton": "recyclable",
+    "jar": "recyclable",
+    "newspaper": "recyclable",
+    "paper": "recyclable",
+    "peel": "compostable",
+    "core": "compostable",
+    "scraps": "compostable",
+    "grounds": "compostable",
+    "eggshell": "compostable",
+    "eggshells": "compostable",
+    "battery": "hazardous",
+    "batteries": "hazardous",
+    "paint": "hazardous",
+    "bulb": "hazardous",
+    "phone": "e-waste",
+    "charger": "e-waste",
+    "cable": "e-waste",
+    "laptop": "e-waste",
+    "shirt": "textile",
+    "t-shirt": "textile",
+    "jeans": "textile",
+    "sock": "textile",
+    "shoe": "textile",
+    "shoes": "textile",
+    "styrofoam": "landfill",
+    "wrapper": "landfill"
+}
+
+# Disposal answers for the most common items, so the reasoning model is only
+# asked about the long tail. Keys are normalized item names
+COMMON_ITEM_CONFIDENCE = 0.95
+COMMON_ITEMS = {
+    # Recyclable
+    "plastic water bottle": ("recyclable", ("Empty and rinse the bottle", "Put the cap back on", "Place in recycling bin")),
+    "plastic bottle": ("recyclable", ("Empty and rinse the bottle", "Put the cap back on", "Place in recycling bin")),
+    "plastic soda bottle": ("recyclable", ("Empty and rinse the bottle", "Put the cap back on", "Place in recycling bin")),
+    "glass bottle": ("recyclable", ("Empty and rinse the bottle", "Remove the cap or cork", "Place in glass recycling")),
+    "glass jar": ("recyclable", ("Empty and rinse the jar", "Remove the lid", "Place in glass recycling")),
+    "wine bottle": ("recyclable", ("Empty and rinse the bottle", "Remove the cork", "Place in glass recycling")),
+    "beer bottle": ("recyclable", ("Empty and rinse the bottle", "Remove the cap", "Place in glass recycling")),
+    "aluminum can": ("recyclable", ("Empty and rinse the can", "Place in recycling bin")),
+    "soda can": ("recyclable", ("Empty and rinse the can", "Place in recycling bin")),
+    "beer can": ("recyclable", ("Empty and rinse the can", "Place in recycling bin")),
+    "tin can": ("recyclable", ("Empty and rinse the can", "Press the lid inside the can", "Place in recycling bin")),
+    "steel can": ("recyclable", ("Empty and rinse the can", "Press the lid inside the can", "Place in recycling bin")),
+    "aluminum foil": ("recyclable", ("Wipe off food residue", "Scrunch into a ball", "Place in recycling bin")),
+    "cardboard box": ("recyclable", ("Remove tape and labels", "Flatten the box", "Place in recycling bin")),
+    "cardboard": ("recyclable", ("Remove tape", "Flatten it", "Place in recycling bin")),
+    "shipping box": ("recyclable", ("Remove tape and labels", "Flatten the box", "Place in recycling bin")),
+    "cereal box": ("recyclable", ("Remove the plastic liner", "Flatten the box", "Place in recycling bin")),
+    "egg carton": ("recyclable", ("Make sure it's empty", "Flatten it", "Place in recycling bin")),
+    "milk carton": ("recyclable", ("Empty and rinse the carton", "Flatten it", "Place in recycling bin")),
+    "juice carton": ("recyclable", ("Empty and rinse the carton", "Flatten it", "Place in recycling bin")),
+    "newspaper": ("recyclable", ("Keep it dry", "Place in paper recycling")),
+    "magazine": ("recyclable", ("Remove any plastic wrap", "Place in paper recycling")),
+    "paper": ("recyclable", ("Keep it dry and clean", "Place in paper recycling")),
+    "paper bag": ("recyclable", ("Make sure it's empty and dry", "Place in paper recycling")),
+    "office paper": ("recyclable", ("Remove staples and clips", "Place in paper recycling")),
+    "envelope": ("recyclable", ("Remove any plastic window if possible", "Place in paper recycling")),
+    "toilet paper roll": ("recyclable", ("Flatten it", "Place in paper recycling")),
+    "paper towel roll": ("recyclable", ("Flatten it", "Place in paper recycling")),
+    "plastic container": ("recyclable", ("Empty and rinse the container", "Place in recycling bin")),
+    "yogurt container": ("recyclable", ("Empty and rinse the container", "Remove the foil lid", "Place in recycling bin")),
+    "plastic milk jug": ("recyclable", ("Empty and rinse the jug", "Put the cap back on", "Place in recycling bin")),
+    "detergent bottle": ("recyclable", ("Empty and rinse the bottle", "Put the cap back on", "Place in recycling bin")),
+    "shampoo bottle": ("recyclable", ("Empty and rinse the bottle", "Put the cap back on", "Place in recycling bin")),
+    # Compostable
+    "banana peel": ("compostable", ("Remove any stickers", "Place in compost bin")),
+    "orange peel": ("compostable", ("Remove any stickers", "Place in compost bin")),
+    "apple core": ("compostable", ("Remove any stickers", "Place in compost bin")),
+    "eggshells": ("compostable", ("Crush the shells", "Place in compost bin")),
+    "egg shells": ("compostable", ("Crush the shells", "Place in compost bin")),
+    "coffee grounds": ("compostable", ("Let them cool", "Place in compost bin")),
+    "tea bag": ("compostable", ("Remove any staple or string tag", "Place in compost bin")),
+    "vegetable scraps": ("compostable", ("Drain any liquid", "Place in compost bin")),
+    "fruit scraps": ("compostable", ("Remove any stickers", "Place in compost bin")),
+    "food scraps": ("compostable", ("Remove any packaging", "Place in compost bin")),
+    "avocado pit": ("compostable", ("Place in compost bin",)),
+    "corn cob": ("compostable", ("Break it into pieces", "Place in compost bin")),
+    "leaves": ("compostable", ("Remove any litter", "Place in compost or yard waste bin")),
+    "paper napkin": ("compostable", ("Place in compost bin",)),
+    "pizza box": ("compostable", ("Remove leftover food", "Tear into pieces", "Place in compost bin")),
+    # Landfill
+    "chip bag": ("landfill", ("Empty the bag", "Place in trash bin")),
+    "candy wrapper": ("landfill", ("Place in trash bin",)),
+    "plastic straw": ("landfill", ("Place in trash bin",)),
+    "styrofoam cup": ("landfill", ("Empty the cup", "Place in trash bin")),
+    "styrofoam container": ("landfill", ("Remove leftover food", "Place in trash bin")),
+    "disposable coffee cup": ("landfill", ("Empty the cup", "Recycle the lid if your area accepts it", "Place the cup in trash bin")),
+    "plastic bag": ("landfill", ("Reuse it if you can", "Take it to a store drop-off, or place in trash bin")),
+    "plastic wrap": ("landfill", ("Place in trash bin",)),
+    "face mask": ("landfill", ("Cut the ear loops", "Place in trash bin")),
+    "diaper": ("landfill", ("Wrap it up", "Place in trash bin")),
+    "cigarette butt": ("landfill", ("Make sure it's fully extinguished", "Place in trash bin")),
+    "toothbrush": ("landfill", ("Place in trash bin",)),
+    # Hazardous
+    "aa battery": ("hazardous", ("Tape over the terminals", "Take to a battery drop-off point")),
+    "aaa battery": ("hazardous", ("Tape over the terminals", "Take to a battery drop-off point")),
+    "battery": ("hazardous", ("Tape over the terminals", "Take to a battery drop-off point")),
+    "batteries": ("hazardous", ("Tape over the terminals", "Take to a battery drop-off point")),
+    "lithium battery": ("hazardous", ("Tape over the terminals", "Take to a battery drop-off point")),
+    "paint can": ("hazardous", ("Keep the lid sealed", "Take to a hazardous waste facility")),
+    "light bulb": ("hazardous", ("Wrap it to prevent breakage", "Take to a hazardous waste drop-off")),
+    "fluorescent bulb": ("hazardous", ("Wrap it to prevent breakage", "Take to a hazardous waste drop-off")),
+    "aerosol can": ("hazardous", ("Don't puncture it", "Take to a hazardous waste facility")),
+    "medication": ("hazardous", ("Keep it in its container", "Take to a pharmacy take-back program")),
+    # E-waste
+    "phone": ("e-waste", ("Back up and erase your data", "Take to an e-waste drop-off")),
+    "smartphone": ("e-waste", ("Back up and erase your data", "Take to an e-waste drop-off")),
+    "cell phone": ("e-waste", ("Back up and erase your data", "Take to an e-waste drop-off")),
+    "laptop": ("e-waste", ("Back up and erase your data", "Take to an e-waste drop-off")),
+    "phone charger": ("e-waste", ("Take to an e-waste drop-off",)),
+    "charger": ("e-waste", ("Take to an e-waste drop-off",)),
+    "usb cable": ("e-waste", ("Take to an e-waste drop-off",)),
+    "headphones": ("e-waste", ("Take to an e-waste drop-off",)),
+    "earbuds": ("e-waste", ("Take to an e-waste drop-off",)),
+    "keyboard": ("e-waste", ("Take to an e-waste drop-off",)),
+    "computer mouse": ("e-waste", ("Remove the batteries", "Take to an e-waste drop-off")),
+    "remote control": ("e-waste", ("Remove the batteries", "Take to an e-waste drop-off")),
+    # Textile
+    "t-shirt": ("textile", ("Wash it", "Donate if wearable, otherwise take to textile recycling")),
+    "cotton t-shirt": ("textile", ("Wash it", "Donate if wearable, otherwise take to textile recycling")),
+    "shirt": ("textile", ("Wash it", "Donate if wearable, otherwise take to textile recycling")),
+    "jeans": ("textile", ("Wash them", "Donate if wearable, otherwise take to textile recycling")),
+    "sweater": ("textile", ("Wash it", "Donate if wearable, otherwise take to textile recycling")),
+    "socks": ("textile", ("Wash them", "Take to textile recycling")),
+    "shoes": ("textile", ("Tie the pair together", "Donate if wearable, otherwise take to textile recycling")),
+    "sneakers": ("textile", ("Tie the pair together", "Donate if wearable, otherwise take to textile recycling")),
+    "towel": ("textile", ("Wash it", "Donate to an animal shelter or take to textile recycling")),
+}
+
+# Map metric types to better prompts
+METRIC_PROMPTS = {
+    "co2_savings": "CO2 emissions prevented",
+    "energy_savings": "energy saved (use relatable comparisons like 'power a laptop for X hours')",
+    "water_conservation": "water conserved (in gallons or liters)",
+    "resource_conservation": "raw materials saved",
+    "landfill_space_saved": "landfill space saved",
+    "pollution_reduction": "pollution prevented"
+}
+
+# Requests take turns through the metrics so each gets even coverage; the
+# order is shuffled once per process so workers don't all move in lockstep
+METRIC_CYCLE = itertools.cycle(random.sample(
+    settings.IMPACT_METRICS_ORDERED, len(settings.IMPACT_METRICS_ORDERED)
+))
+
+# Educator system prompt for each metric, built once at import
+EDUCATOR_SYSTEM_PROMPTS = {
+    metric_type: f"""You are an environmental educator. Create engaging, specific feedback about the environmental impact of proper disposal.
+
+Focus on: {METRIC_PROMPTS[metric_type]}
+
+Requirements:
+1. Start with the primary benefit
+2. Include a SPECIFIC, QUANTIFIED metric (e.g., "saves enough energy to charge your phone 500 times", not just "saves energy")
+3. Add one interesting fact or comparison
+4. Keep it under 3 sentences
+5. Be encouraging and friendly, not preachy
+
+Make the user feel good about their eco-friendly choice!"""
+    for metric_type in settings.IMPACT_METRICS_ORDERED
+}
+
+
+def encode_image_to_base64(image_bytes):
+    """Convert image bytes to base64 bytes (kept as bytes to avoid an extra str copy)"""
+    return base64.b64encode(image_bytes)
+
+
+def parse_model_json(content):
+    """
+    Parse JSON from model output, unwrapping a markdown code fence if needed
+    Well-behaved output is parsed directly without scanning for a fence
+    """
+    try:
+        return orjson.loads(content)
+    except orjson.JSONDecodeError:
+        match = FENCE_RE.search(content)
+        if match is None:
+            raise
+        return orjson.loads(match.group(1))
+
+
+def sniff_image_format(head):
+    """Identify JPEG/PNG/WEBP from the first bytes of an upload, None if unknown"""
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def normalize_item_name(object_name):
+    """Canonical form of an item name, used for cache keys"""
+    return object_name.lower().strip()
+
+
+def async_cached(cache, key, cache_if=None):
+    """
+    Memoize a coroutine's results in a cachetools cache
+    Results for which cache_if(result) is false are returned but not stored
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args):
+            cache_key = key(*args)
+            try:
+                result = cache[cache_key]
+                logger.debug("💾 Cache hit for %s: %s", func.__name__, cache_key)
+                return result
+            except KeyError:
+                pass
+            
+            result = await func(*args)
+            if cache_if is None or cache_if(result):
+                cache[cache_key] = result
+            return result
+        return wrapper
+    return decorator
+
+
+async def post_to_api(body):
+    """POST a serialized chat completion payload, retrying gateway errors with backoff"""
+    for attempt in range(MAX_RETRIES + 1):
+        response = await app.state.http_client.post(
+            settings.API_ENDPOINT, headers=API_HEADERS, content=body
+        )
+        if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+            return response
+        
+        delay = RETRY_BACKOFF * (2 ** attempt)
+        logger.warning("   ⚠️ Status %s, retrying in %.1fs", response.status_code, delay)
+        await asyncio.sleep(delay)
+
+
+@functools.cache
+def load_pyvips():
+    """
+    Import libvips on first use, like Pillow, to keep worker cold starts fast
+    It's optional and needs the native library installed, so shrink_image()
+    falls back to Pillow when it can't be loaded
+    Returns: the pyvips module, or None
+    """
+    try:
+        import pyvips
+    except (ImportError, OSError):
+        return None
+    return pyvips
+
+
+def resize_with_vips(image_bytes):
+    """Decode, downscale and re-encode an image with libvips, returns JPEG bytes"""
+    pyvips = load_pyvips()
+    image = pyvips.Image.thumbnail_buffer(
+        image_bytes, MAX_IMAGE_SIZE, height=MAX_IMAGE_SIZE, size="down"
+    )
+    logger.debug("   Dimensions after thumbnail: (%s, %s)", image.width, image.height)
+    
+    # Same job as Pillow's convert('RGB'): CMYK, 16-bit and other colour
+    # spaces are mapped to 8-bit sRGB before encoding
+    if image.interpretation not in ("srgb", "b-w"):
+        logger.debug("   Converting from %s to sRGB", image.interpretation)
+        image = image.colourspace("srgb")
+    return image.jpegsave_buffer(Q=JPEG_QUALITY, strip=True, optimize_coding=False)
+
+
+def resize_with_pillow(image):
+    """
+    Downscale and re-encode an opened Pillow image
+    Returns: (jpeg_bytes, resized_image)
+    """
+    from PIL import Image
+    
+    # Let the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding; this has
+    # to happen before anything calls load()
+    image.draft('RGB', (MAX_IMAGE_SIZE, MAX_IMAGE_SIZE))
+    
+    # Convert to RGB if needed
+    if image.mode not in ('RGB', 'L'):
+        logger.debug("   Converting from %s to RGB", image.mode)
+        image = image.convert('RGB')
+    
+    # Resize if image is too large
+    original_size = image.size
+    image.thumbnail(
+        (MAX_IMAGE_SIZE, MAX_IMAGE_SIZE), Image.Resampling.LANCZOS,
+        reducing_gap=RESIZE_REDUCING_GAP
+    )
+    
+    if image.size != original_size:
+        logger.debug("   Resized to: %s", image.size)
+    
+    # Convert back to bytes (getvalue() hands over BytesIO's buffer without a copy)
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=JPEG_QUALITY)
+    return output.getvalue(), image
+
+
+def image_fingerprint(image):
+    """
+    256-bit difference hash (dHash) of a Pillow image, used as the response cache key
+    Repeat uploads of the same photo give the same hash
+    """
+    from PIL import Image
+    
+    # Only 17x16 greyscale pixels are needed, so an undecoded JPEG is decoded at
+    # 1/8 scale; this is a no-op for images that are already loaded
+    image.draft('L', (128, 128))
+    pixels = image.convert('L').resize((17, 16), Image.Resampling.BILINEAR).tobytes()
+    
+    fingerprint = 0
+    for row in range(0, 17 * 16, 17):
+        for col in range(row, row + 16):
+            fingerprint = (fingerprint << 1) | (pixels[col] < pixels[col + 1])
+    return fingerprint
+
+
+def is_cacheable_fingerprint(fingerprint):
+    """Near-uniform images (blank, dark, plain gradients) all hash alike, so don't cache them"""
+    return MIN_FINGERPRINT_BITS <= fingerprint.bit_count() <= FINGERPRINT_BITS - MIN_FINGERPRINT_BITS
+
+
+def shrink_image(upload):
+    """
+    Shrink an uploaded image (a binary file object) for the vision model
+    Small JPEGs without metadata are passed through untouched; everything else
+    is re-encoded, using libvips when available and falling back to Pillow on
+    any libvips error
+    Returns: (jpeg_bytes, image) where image is a Pillow image of the result
+    (decoded or not), or None when libvips did the work
+    """
+    # Pillow is imported on first use to keep worker cold starts fast
+    from PIL import Image
+    
+    # Only reads the header, pixels aren't decoded until they're needed, and
+    # Pillow reads them straight from the upload rather than a bytes copy
+    image = Image.open(upload)
+    logger.debug("   Format: %s, Dimensions: %s", image.format, image.size)
+    
+    # Pillow's own bomb check only warns below twice its limit, so enforce
+    # ours here, before either Pillow or libvips decodes the pixels
+    if image.width * image.height > MAX_IMAGE_PIXELS:
+        raise ValueError(f"image is {image.width}x{image.height}, too many pixels")
+    
+    # Reading the raw bytes is fine after open(): Pillow seeks to the pixel
+    # data itself when it decodes
+    if (image.format == 'JPEG' and image.mode in ('RGB', 'L')
+            and max(image.size) <= MAX_IMAGE_SIZE
+            and not any(key in image.info for key in JPEG_METADATA_KEYS)):
+        logger.debug("   Already a small JPEG, skipping re-encode")
+        upload.seek(0)
+        return upload.read(), image
+    
+    pyvips = load_pyvips()
+    if pyvips is not None:
+        try:
+            upload.seek(0)
+            return resize_with_vips(upload.read()), None
+        except pyvips.Error as e:
+            logger.warning("   ⚠️ libvips failed (%s), falling back to Pillow", e)
+    return resize_with_pillow(image)
+
+
+def prepare_image(upload):
+    """
+    Validate and shrink an uploaded image file (CPU-bound, run it in a worker thread)
+    Returns: (image_base64, fingerprint) where image_base64 is the base64 of
+    the shrunk JPEG and fingerprint is the image's dHash
+    """
+    from PIL import Image
+    
+    jpeg_bytes, image = shrink_image(upload)
+    logger.debug("   Final size: %d bytes", len(jpeg_bytes))
+    # Reuse the image Pillow already has instead of decoding the JPEG again
+    if image is None:
+        image = Image.open(BytesIO(jpeg_bytes))
+    return encode_image_to_base64(jpeg_bytes), image_fingerprint(image)
+
+
+def build_vision_body_parts(metric_type):
+    """
+    Serialize the vision payload for metric_type around a placeholder image URL
+    Returns: (head, tail) bytes; the request body is head + data URI + tail
+    """
+    payload = {
+        "model": settings.VISION_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": VISION_PROMPT
+                    },
+                    {
+                        "type": "text",
+                        "text": f"Feedback focus: {METRIC_PROMPTS[metric_type]}"
                     },
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_base64}"
+                            "url": IMAGE_URL_PLACEHOLDER
                         }
                     }
                 ]
             }
         ],
-        "max_tokens": 150,
+        "response_format": {"type": "json_object"},
+        "max_tokens": 400,
         "temperature": 0.2
     }
     
+    head, tail = orjson.dumps(payload).split(IMAGE_URL_PLACEHOLDER.encode())
+    return head, tail
+
+
+# The vision payload is static apart from the image, so it's serialized once
+# per metric. Base64 needs no JSON escaping, so the image bytes are spliced in
+# directly instead of being decoded to str and re-encoded by the serializer
+IMAGE_URL_PLACEHOLDER = "__IMAGE_URL__"
+VISION_BODY_PARTS = {
+    metric_type: build_vision_body_parts(metric_type)
+    for metric_type in settings.IMPACT_METRICS_ORDERED
+}
+
+
+async def call_vision_model(image_base64, metric_type):
+    """
+    Call NVIDIA Nemotron vision model to identify and validate the object, and
+    in the same call categorize it and write feedback focused on metric_type
+    Returns: dict with is_waste_item, item_name, rejection_reason, confidence,
+    plus category, category_confidence, preparation_steps and feedback when the
+    model provides them
+    """
+    head, tail = VISION_BODY_PARTS[metric_type]
+    body = b"".join((head, DATA_URI_PREFIX, image_base64, tail))
+    # The body holds its own copy, and callers hand over their reference, so
+    # this frees the base64 before the network wait
+    del image_base64
+    
     try:
-        print(f"🔍 Calling vision model: {settings.VISION_MODEL}")
-        response = requests.post(settings.API_ENDPOINT, headers=headers, json=payload, timeout=60)
+        logger.debug("🔍 Calling vision model: %s", settings.VISION_MODEL)
+        response = await post_to_api(body)
         
-        print(f"   Status: {response.status_code}")
+        logger.debug("   Status: %s", response.status_code)
         
         if response.status_code != 200:
-            print(f"   Error Response: {response.text}")
+            logger.error("   Error Response: %s", response.text)
             raise HTTPException(
                 status_code=response.status_code,
                 detail=f"Vision model error: {response.text}"
             )
         
-        result = response.json()
+        result = orjson.loads(response.content)
         content = result["choices"][0]["message"]["content"].strip()
         
         # Try to parse JSON response
         try:
-            # Remove markdown code blocks if present
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            parsed = json.loads(content)
-            print(f"   ✅ Vision result: {parsed}")
+            parsed = parse_model_json(content)
+            logger.debug("   ✅ Vision result: %s", parsed)
             return parsed
             
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             # Fallback: try to extract info from text
-            print(f"   ⚠️ Could not parse JSON, using fallback")
+            logger.warning("   ⚠️ Could not parse JSON, using fallback")
             return {
                 "is_waste_item": True,
                 "item_name": content.lower(),
                 "rejection_reason": None,
-                "confidence": 0.7
+                "confidence": 0.7,
+                "fallback": True
             }
     
-    except requests.exceptions.Timeout:
-        print("   ❌ Request timed out")
+    except httpx.TimeoutException:
+        logger.error("   ❌ Request timed out")
         raise HTTPException(status_code=504, detail="Vision model request timed out")
-    except requests.exceptions.RequestException as e:
-        print(f"   ❌ Request error: {e}")
+    except httpx.HTTPError as e:
+        logger.error("   ❌ Request error: %s", e)
         raise HTTPException(status_code=500, detail=f"Vision model error: {str(e)}")
     except Exception as e:
-        print(f"   ❌ Unexpected error: {e}")
+        logger.error("   ❌ Unexpected error: %s", e)
         raise HTTPException(status_code=500, detail=f"Vision processing error: {str(e)}")
 
 
-def call_reasoning_model(object_name):
+# A garbled reply shouldn't pin a fallback category on the item for good
+@async_cached(reasoning_cache, key=normalize_item_name, cache_if=lambda result: not result.get("fallback"))
+async def call_reasoning_model(object_name):
     """
     Call NVIDIA Llama-Nemotron reasoning model to determine disposal category
-    Returns: dict with category, preparation_steps, confidence
+    Returns: dict with category, preparation_steps, confidence, plus
+    fallback=True when the reply couldn't be used as given
     """
-    headers = {
-        "Authorization": f"Bearer {settings.NVIDIA_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
     payload = {
         "model": settings.REASONING_MODEL,
         "messages": [
             {
                 "role": "system",
-                "content": """You are a waste management expert. Classify items into these categories:
-
-1. recyclable - Clean paper, cardboard, glass bottles/jars, metal cans, plastic bottles/containers (#1-7)
-2. compostable - Food scraps, fruit/vegetable peels, coffee grounds, yard waste, paper napkins
-3. landfill - Contaminated items, mixed materials, chip bags, styrofoam, used napkins
-4. hazardous - Batteries, paint, chemicals, motor oil, pesticides, fluorescent bulbs
-5. e-waste - Electronics, phones, computers, cables, small appliances, chargers
-6. textile - Clothes, shoes, bags, fabric, towels, bedding
-
-Provide 2-3 brief preparation steps if needed."""
+                "content": REASONING_SYSTEM_PROMPT
             },
             {
                 "role": "user",
@@ -177,110 +828,74 @@ Respond ONLY with JSON:
     }
     
     try:
-        print(f"🤔 Calling reasoning model: {settings.REASONING_MODEL}")
-        response = requests.post(settings.API_ENDPOINT, headers=headers, json=payload, timeout=60)
+        logger.debug("🤔 Calling reasoning model: %s", settings.REASONING_MODEL)
+        response = await post_to_api(orjson.dumps(payload))
         
-        print(f"   Status: {response.status_code}")
+        logger.debug("   Status: %s", response.status_code)
         
         if response.status_code != 200:
-            print(f"   Error Response: {response.text}")
+            logger.error("   Error Response: %s", response.text)
             raise HTTPException(
                 status_code=response.status_code,
                 detail=f"Reasoning model error: {response.text}"
             )
         
-        result = response.json()
+        result = orjson.loads(response.content)
         content = result["choices"][0]["message"]["content"].strip()
         
         # Parse JSON response
         try:
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            parsed = json.loads(content)
+            parsed = parse_model_json(content)
             
-            # Validate category
-            valid_categories = ["recyclable", "compostable", "landfill", "hazardous", "e-waste", "textile"]
-            if parsed.get("category") not in valid_categories:
+            # Normalize and validate category
+            category = CATEGORY_ALIASES.get(str(parsed.get("category", "")).strip().lower())
+            if category is None:
                 # Fallback to landfill if invalid
-                parsed["category"] = "landfill"
+                category = "landfill"
                 parsed["confidence"] = 0.5
+                parsed["fallback"] = True
+            parsed["category"] = category
             
-            print(f"   ✅ Category: {parsed['category']} (confidence: {parsed.get('confidence', 0.8)})")
+            logger.debug("   ✅ Category: %s (confidence: %s)", parsed['category'], parsed.get('confidence', 0.8))
             return parsed
             
-        except json.JSONDecodeError:
-            # Fallback parsing
-            content_lower = content.lower()
+        except orjson.JSONDecodeError:
+            # Fallback parsing: first whole word that names a category wins,
+            # so e.g. "composite" or "non-recyclable" don't match
             category = "landfill"
-            
-            if "recyclable" in content_lower or "recycle" in content_lower:
-                category = "recyclable"
-            elif "compost" in content_lower:
-                category = "compostable"
-            elif "hazardous" in content_lower:
-                category = "hazardous"
-            elif "e-waste" in content_lower or "electronic" in content_lower:
-                category = "e-waste"
-            elif "textile" in content_lower or "fabric" in content_lower:
-                category = "textile"
+            for word in WORD_RE.findall(content.lower()):
+                if word in CATEGORY_ALIASES:
+                    category = CATEGORY_ALIASES[word]
+                    break
             
             return {
                 "category": category,
                 "preparation_steps": [],
-                "confidence": 0.7
+                "confidence": 0.7,
+                "fallback": True
             }
     
-    except requests.exceptions.Timeout:
-        print("   ❌ Request timed out")
+    except httpx.TimeoutException:
+        logger.error("   ❌ Request timed out")
         raise HTTPException(status_code=504, detail="Reasoning model request timed out")
-    except requests.exceptions.RequestException as e:
-        print(f"   ❌ Request error: {e}")
+    except httpx.HTTPError as e:
+        logger.error("   ❌ Request error: %s", e)
         raise HTTPException(status_code=500, detail=f"Reasoning model error: {str(e)}")
 
 
-def call_educator_model(object_name, category):
+@async_cached(educator_cache, key=lambda name, category, metric: (normalize_item_name(name), category, metric))
+async def call_educator_model(object_name, category, metric_type):
     """
     Call NVIDIA Nemotron educator model to provide environmental impact feedback
+    focused on metric_type (one of settings.IMPACT_METRICS)
     Returns: dict with primary_metric and feedback text
     """
-    headers = {
-        "Authorization": f"Bearer {settings.NVIDIA_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    # Randomly select a primary metric to focus on
-    metric_type = random.choice(settings.IMPACT_METRICS)
-    
-    # Map metric types to better prompts
-    metric_prompts = {
-        "co2_savings": "CO2 emissions prevented",
-        "energy_savings": "energy saved (use relatable comparisons like 'power a laptop for X hours')",
-        "water_conservation": "water conserved (in gallons or liters)",
-        "resource_conservation": "raw materials saved",
-        "landfill_space_saved": "landfill space saved",
-        "pollution_reduction": "pollution prevented"
-    }
-    
     payload = {
         "model": settings.EDUCATOR_MODEL,
         "messages": [
             {
                 "role": "system",
-                "content": f"""You are an environmental educator. Create engaging, specific feedback about the environmental impact of proper disposal.
-
-Focus on: {metric_prompts[metric_type]}
-
-Requirements:
-1. Start with the primary benefit
-2. Include a SPECIFIC, QUANTIFIED metric (e.g., "saves enough energy to charge your phone 500 times", not just "saves energy")
-3. Add one interesting fact or comparison
-4. Keep it under 3 sentences
-5. Be encouraging and friendly, not preachy
-
-Make the user feel good about their eco-friendly choice!"""
+                "content": EDUCATOR_SYSTEM_PROMPTS[metric_type]
             },
             {
                 "role": "user",
@@ -292,37 +907,72 @@ Make the user feel good about their eco-friendly choice!"""
     }
     
     try:
-        print(f"📚 Calling educator model: {settings.EDUCATOR_MODEL}")
-        print(f"   Focus metric: {metric_type}")
-        response = requests.post(settings.API_ENDPOINT, headers=headers, json=payload, timeout=60)
+        logger.debug("📚 Calling educator model: %s", settings.EDUCATOR_MODEL)
+        logger.debug("   Focus metric: %s", metric_type)
+        response = await post_to_api(orjson.dumps(payload))
         
-        print(f"   Status: {response.status_code}")
+        logger.debug("   Status: %s", response.status_code)
         
         if response.status_code != 200:
-            print(f"   Error Response: {response.text}")
+            logger.error("   Error Response: %s", response.text)
             raise HTTPException(
                 status_code=response.status_code,
                 detail=f"Educator model error: {response.text}"
             )
         
-        result = response.json()
+        result = orjson.loads(response.content)
         feedback = result["choices"][0]["message"]["content"].strip()
         
-        print(f"   ✅ Feedback generated ({len(feedback)} chars)")
+        logger.debug("   ✅ Feedback generated (%d chars)", len(feedback))
         
         return {
             "primary_metric": metric_type,
             "feedback": feedback
         }
     
-    except requests.exceptions.Timeout:
-        print("   ❌ Request timed out")
+    except httpx.TimeoutException:
+        logger.error("   ❌ Request timed out")
         raise HTTPException(status_code=504, detail="Educator model request timed out")
-    except requests.exceptions.RequestException as e:
-        print(f"   ❌ Request error: {e}")
+    except httpx.HTTPError as e:
+        logger.error("   ❌ Request error: %s", e)
         raise HTTPException(status_code=500, detail=f"Educator model error: {str(e)}")
 
 
+def discard_task(task):
+    """Cancel a task whose result is no longer needed, without leaving its error unretrieved"""
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+def lookup_common_item(object_name):
+    """
+    Look an item up in COMMON_ITEMS by its full name, or else by its longest
+    ending of two or more words, so "empty plastic water bottle" matches
+    "plastic water bottle" but "plastic bottle cap" doesn't match anything
+    Returns: (category, preparation_steps) or None
+    """
+    known = COMMON_ITEMS.get(normalize_item_name(object_name))
+    if known is not None:
+        return known
+    
+    words = WORD_RE.findall(object_name.lower())
+    for start in range(1, len(words) - 1):
+        known = COMMON_ITEMS.get(" ".join(words[start:]))
+        if known is not None:
+            return known
+    return None
+
+
+def guess_category(object_name):
+    """Cheap keyword guess at an item's category, None when nothing matches"""
+    for word in WORD_RE.findall(object_name.lower()):
+        if word in CATEGORY_HINTS:
+            return CATEGORY_HINTS[word]
+        if word in CATEGORY_ALIASES:
+            return CATEGORY_ALIASES[word]
+    return None
+
+
 def get_friendly_rejection_message(rejection_reason):
     """Return user-friendly message for rejected images"""
     messages = {
@@ -368,161 +1018,376 @@ async def health_check():
     }
 
 
-@app.post("/classify")
-async def classify_waste(file: UploadFile = File(...)):
+@contextmanager
+def log_request_errors():
+    """Log request failures and turn unexpected exceptions into 500 responses"""
+    try:
+        yield
+    except HTTPException as he:
+        logger.warning("❌ HTTP Exception: %s - %s", he.status_code, he.detail)
+        raise he
+    except Exception as e:
+        logger.exception("❌ Unexpected error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+
+def upload_etag(upload):
+    """Strong ETag for an upload file: a hash of its raw bytes"""
+    upload.seek(0)
+    digest = hashlib.blake2b(digest_size=16)
+    while chunk := upload.read(HASH_CHUNK_BYTES):
+        digest.update(chunk)
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header against an ETag"""
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags or "*" in tags
+
+
+def etag_headers(etag):
+    """Response headers advertising an upload's ETag"""
+    return {"ETag": etag, "Cache-Control": ETAG_CACHE_CONTROL}
+
+
+async def check_if_none_match(request, file):
     """
-    Main endpoint: Accepts an image and returns classification, disposal method, and feedback
+    Evaluate the request's If-None-Match against the upload's ETag, hashing
+    the upload only when the header is present. POST can't be answered with
+    304, so a match fails the precondition with 412 (RFC 9110 section 13.1.2)
+    Returns: the upload's ETag, or None when there's no If-None-Match
     """
-    print("\n" + "="*60)
-    print("🌱 NEW REQUEST RECEIVED (v2.0)")
-    print("="*60)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return None
+    
+    etag = await asyncio.to_thread(upload_etag, file.file)
+    if etag_matches(if_none_match, etag):
+        raise HTTPException(
+            status_code=412,
+            detail="Image already classified (If-None-Match matched)",
+            headers=etag_headers(etag)
+        )
+    return etag
+
+
+async def check_upload(file):
+    """Validate an upload's size and type without decoding it"""
+    # file.size can be missing; the upload is already spooled, so measuring
+    # it is just a seek
+    size = file.size
+    if size is None:
+        size = file.file.seek(0, SEEK_END)
+    
+    # Reject oversized or non-image uploads before reading the body
+    if size > settings.MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image too large")
     
+    await file.seek(0)
+    if sniff_image_format(await file.read(SNIFF_BYTES)) is None:
+        raise HTTPException(
+            status_code=415,
+            detail="Unsupported file type, please upload a JPEG, PNG or WEBP image"
+        )
+    logger.debug("   Original size: %d bytes", size)
+
+
+async def read_upload_image(file):
+    """
+    Prepare an upload that passed check_upload() for the vision model
+    Returns: (image_base64, fingerprint), see prepare_image()
+    """
+    # Verify it's a valid image, downscale and re-encode as JPEG. Pillow reads
+    # the spooled upload directly instead of a full bytes copy. Decoding is
+    # CPU-bound, so run it in a worker thread to keep the event loop free
+    await file.seek(0)
     try:
-        # Read and validate image
-        print(f"📸 Processing file: {file.filename}")
-        image_bytes = await file.read()
-        print(f"   Original size: {len(image_bytes):,} bytes")
+        image_base64, fingerprint = await asyncio.to_thread(prepare_image, file.file)
+        logger.debug("   Fingerprint: %064x", fingerprint)
+        return image_base64, fingerprint
         
-        # Verify it's a valid image
-        try:
-            image = Image.open(BytesIO(image_bytes))
-            print(f"   Format: {image.format}, Dimensions: {image.size}")
-            
-            # Convert to RGB if needed
-            if image.mode not in ('RGB', 'L'):
-                print(f"   Converting from {image.mode} to RGB")
-                image = image.convert('RGB')
-            
-            # Resize if image is too large
-            max_size = (1024, 1024)
-            original_size = image.size
-            image.thumbnail(max_size, Image.Resampling.LANCZOS)
-            
-            if image.size != original_size:
-                print(f"   Resized to: {image.size}")
-            
-            # Convert back to bytes
-            output = BytesIO()
-            image.save(output, format='JPEG', quality=85)
-            image_bytes = output.getvalue()
-            print(f"   Final size: {len(image_bytes):,} bytes")
-            
-        except Exception as e:
-            print(f"   ❌ Image validation failed: {e}")
-            raise HTTPException(status_code=400, detail=f"Invalid image file: {str(e)}")
-        
-        # Step 1: Encode image
-        print("\n📦 Encoding image to base64...")
-        image_base64 = encode_image_to_base64(image_bytes)
+    except Exception as e:
+        logger.warning("   ❌ Image validation failed: %s", e)
+        raise HTTPException(status_code=400, detail=f"Invalid image file: {str(e)}")
+
+
+async def identify_and_categorize(image_base64, metric_type):
+    """
+    Identify the item in a prepared base64 image and determine its disposal category
+    Returns: (result, feedback, fallback) where result is the rejection response
+    or the classification response without environmental_impact, feedback is
+    the vision model's environmental feedback, a running educator call for the
+    final category, or None, and fallback=True when a model reply couldn't be
+    used as given
+    """
+    # Steps 1-2: Identify and validate the object with the vision model (the
+    # image was already encoded in the worker thread). The base64 isn't kept
+    # here, so call_vision_model() can free it once the request body is built
+    logger.debug("[1/3] Identifying object...")
+    vision_call = call_vision_model(image_base64, metric_type)
+    del image_base64
+    vision_result = await vision_call
+    
+    # Check if this is a valid waste item
+    if not vision_result.get("is_waste_item", False):
+        rejection_reason = vision_result.get("rejection_reason", "default")
+        friendly_message = get_friendly_rejection_message(rejection_reason)
         
-        # Step 2: Identify and validate object using vision model
-        print("\n[1/3] Identifying object...")
-        vision_result = call_vision_model(image_base64)
+        logger.info("❌ Rejected: %s", rejection_reason)
         
-        # Check if this is a valid waste item
-        if not vision_result.get("is_waste_item", False):
-            rejection_reason = vision_result.get("rejection_reason", "default")
-            friendly_message = get_friendly_rejection_message(rejection_reason)
-            
-            print(f"\n❌ REJECTED: {rejection_reason}")
-            print("="*60 + "\n")
-            
-            result = {
-                "success": False,
-                "is_waste_item": False,
-                "rejection_reason": rejection_reason,
-                "message": friendly_message,
-                "confidence": vision_result.get("confidence", 0.0)
-            }
+        return {
+            "success": False,
+            "is_waste_item": False,
+            "rejection_reason": rejection_reason,
+            "message": friendly_message,
+            "confidence": vision_result.get("confidence", 0.0)
+        }, None, False
+    
+    # The vision model occasionally names the item with a number or a list
+    object_name = vision_result.get("item_name")
+    if not isinstance(object_name, str):
+        object_name = str(object_name) if object_name else ""
+    object_name = object_name.strip() or "unknown item"
+    vision_confidence = vision_result.get("confidence", 0.8)
+    fallback = vision_result.get("fallback", False)
+    
+    feedback = vision_result.get("feedback")
+    has_feedback = isinstance(feedback, str) and bool(feedback.strip())
+    if not has_feedback:
+        feedback = None
+    
+    # Step 3: Use the vision model's category when it gave a valid one, then
+    # the common items table, and only then the reasoning model. Missing
+    # preparation steps aren't worth another round-trip, so they default to none
+    category = CATEGORY_ALIASES.get(str(vision_result.get("category", "")).strip().lower())
+    if category is not None:
+        logger.debug("[2/3] Category from vision model: %s", category)
+        preparation_steps = vision_result.get("preparation_steps")
+        if not isinstance(preparation_steps, list):
+            preparation_steps = []
+        reasoning_confidence = vision_result.get("category_confidence") or vision_confidence
+    elif (known := lookup_common_item(object_name)) is not None:
+        category, preparation_steps = known[0], list(known[1])
+        logger.debug("[2/3] Known item, category: %s", category)
+        reasoning_confidence = COMMON_ITEM_CONFIDENCE
+    else:
+        logger.debug("[2/3] Determining disposal category...")
         
-            # Print the JSON being sent
-            print(f"\n📤 Sending rejection response:")
-            print(json.dumps(result, indent=2))
-            print("="*60 + "\n")
-            
-            return result
-
-        object_name = vision_result.get("item_name", "unknown item")
-        vision_confidence = vision_result.get("confidence", 0.8)
+        # Without vision feedback, speculatively start the educator call on a
+        # guessed category so it runs alongside the reasoning call
+        guess = guess_category(object_name)
+        if guess is not None and not has_feedback:
+            logger.debug("   Speculative educator call for category: %s", guess)
+            feedback = asyncio.create_task(call_educator_model(object_name, guess, metric_type))
         
-        # Step 3: Determine disposal category using reasoning model
-        print("\n[2/3] Determining disposal category...")
-        reasoning_result = call_reasoning_model(object_name)
+        try:
+            reasoning_result = await call_reasoning_model(object_name)
+        except BaseException:
+            if isinstance(feedback, asyncio.Task):
+                discard_task(feedback)
+            raise
         
         category = reasoning_result.get("category", "landfill")
         preparation_steps = reasoning_result.get("preparation_steps", [])
         reasoning_confidence = reasoning_result.get("confidence", 0.8)
+        fallback = fallback or reasoning_result.get("fallback", False)
+        
+        if isinstance(feedback, asyncio.Task) and guess != category:
+            logger.debug("   Guessed %s but category is %s, discarding speculative feedback", guess, category)
+            discard_task(feedback)
+            feedback = None
+    
+    # Calculate overall confidence (average of vision and reasoning)
+    overall_confidence = (vision_confidence + reasoning_confidence) / 2
+    
+    # Determine confidence level
+    if overall_confidence >= settings.CONFIDENCE_HIGH:
+        confidence_level = "high"
+    elif overall_confidence >= settings.CONFIDENCE_MEDIUM:
+        confidence_level = "medium"
+    else:
+        confidence_level = "low"
+    
+    # Get category metadata
+    category_info = CATEGORY_INFO.get(category) or {
+        "name": category,
+        "icon": "🗑️",
+        "color": "#FF9500",
+        "description": ""
+    }
+    
+    # Build response
+    return {
+        "success": True,
+        "is_waste_item": True,
+        "object": object_name,
+        "category": category,
+        "category_info": category_info,
+        "preparation_steps": preparation_steps,
+        "confidence": {
+            "score": round(overall_confidence, 2),
+            "level": confidence_level,
+            "vision": round(vision_confidence, 2),
+            "reasoning": round(reasoning_confidence, 2)
+        }
+    }, feedback, fallback
+
+
+async def get_environmental_impact(result, metric_type, feedback=None):
+    """
+    Step 4: Get environmental feedback for a classification, calling the
+    educator model only when identify_and_categorize() didn't already provide
+    the feedback or start the call
+    Returns: dict with primary_metric and feedback
+    """
+    if isinstance(feedback, asyncio.Task):
+        feedback = (await feedback)["feedback"]
+    elif feedback is None:
+        logger.debug("[3/3] Generating environmental feedback...")
+        educator_result = await call_educator_model(result["object"], result["category"], metric_type)
+        feedback = educator_result["feedback"]
+    
+    logger.info(
+        "✅ Completed: object=%s category=%s confidence=%s (%.2f) metric=%s",
+        result["object"], result["category"], result["confidence"]["level"],
+        result["confidence"]["score"], metric_type
+    )
+    return {
+        "primary_metric": metric_type,
+        "feedback": feedback
+    }
+
+
+@app.post("/classify")
+async def classify_waste(request: Request, response: Response, file: UploadFile = File(...)):
+    """
+    Main endpoint: Accepts an image and returns classification, disposal method, and feedback
+    Freshly computed responses carry an ETag of the image; re-sending it in
+    If-None-Match gets a 412 before the image is decoded, see check_if_none_match()
+    """
+    logger.info("🌱 New request: %s", file.filename)
+    
+    # Pick the next primary metric to focus on
+    metric_type = next(METRIC_CYCLE)
+    
+    with log_request_errors():
+        await check_upload(file)
+        etag = await check_if_none_match(request, file)
         
-        # Step 4: Get environmental feedback using educator model
-        print("\n[3/3] Generating environmental feedback...")
-        educator_result = call_educator_model(object_name, category)
+        image_base64, fingerprint = await read_upload_image(file)
         
-        # Calculate overall confidence (average of vision and reasoning)
-        overall_confidence = (vision_confidence + reasoning_confidence) / 2
+        cacheable = is_cacheable_fingerprint(fingerprint)
+        cached, distance = response_cache.find(fingerprint) if cacheable else (None, None)
+        if cached is not None:
+            logger.info("💾 Response cache hit: %064x (distance %d)", fingerprint, distance)
+            if etag is not None:
+                response.headers.update(etag_headers(etag))
+            return {**cached, "cached": True}
         
-        # Determine confidence level
-        if overall_confidence >= settings.CONFIDENCE_HIGH:
-            confidence_level = "high"
-        elif overall_confidence >= settings.CONFIDENCE_MEDIUM:
-            confidence_level = "medium"
-        else:
-            confidence_level = "low"
+        # Hand the base64 over instead of keeping it alive for every model call
+        identify = identify_and_categorize(image_base64, metric_type)
+        del image_base64
+        result, feedback, fallback = await identify
+        if result["success"]:
+            result["environmental_impact"] = await get_environmental_impact(result, metric_type, feedback)
+        # Fallback answers are a guess, so the next upload gets a fresh try
+        if cacheable and not fallback:
+            response_cache[fingerprint] = result
         
-        # Get category metadata
-        category_info = settings.WASTE_CATEGORIES.get(category, {})
+        # Hashing is negligible next to the model calls this response cost
+        if etag is None:
+            etag = await asyncio.to_thread(upload_etag, file.file)
+        response.headers.update(etag_headers(etag))
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📤 Sending response:\n%s", orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
+    
+    return result
+
+
+@app.post("/classify/stream")
+async def classify_waste_stream(request: Request, file: UploadFile = File(...)):
+    """
+    Streaming variant of /classify that returns newline-delimited JSON
+    The first line is the /classify response without environmental_impact,
+    sent as soon as the category is known; for waste items a second line
+    carries {"environmental_impact": ...} once the educator model answers
+    ETag and If-None-Match work as for /classify
+    """
+    logger.info("🌱 New streaming request: %s", file.filename)
+    
+    metric_type = next(METRIC_CYCLE)
+    
+    with log_request_errors():
+        await check_upload(file)
+        etag = await check_if_none_match(request, file)
         
-        # Build response
-        result = {
-            "success": True,
-            "is_waste_item": True,
-            "object": object_name,
-            "category": category,
-            "category_info": {
-                "name": category,
-                "icon": category_info.get("icon", "🗑️"),
-                "color": category_info.get("color", "#FF9500"),
-                "description": category_info.get("description", "")
-            },
-            "preparation_steps": preparation_steps,
-            "confidence": {
-                "score": round(overall_confidence, 2),
-                "level": confidence_level,
-                "vision": round(vision_confidence, 2),
-                "reasoning": round(reasoning_confidence, 2)
-            },
-            "environmental_impact": {
-                "primary_metric": educator_result["primary_metric"],
-                "feedback": educator_result["feedback"]
-            }
-        }
+        image_base64, fingerprint = await read_upload_image(file)
         
-        print("\n" + "="*60)
-        print("✅ REQUEST COMPLETED SUCCESSFULLY")
-        print("="*60)
-        print(f"Object: {object_name}")
-        print(f"Category: {category}")
-        print(f"Confidence: {confidence_level} ({overall_confidence:.2f})")
-        print(f"Metric: {educator_result['primary_metric']}")
-        print("="*60 + "\n")
+        cacheable = is_cacheable_fingerprint(fingerprint)
+        cached, distance = response_cache.find(fingerprint) if cacheable else (None, None)
+        if cached is None:
+            identify = identify_and_categorize(image_base64, metric_type)
+            del image_base64
+            result, feedback, fallback = await identify
+            cacheable = cacheable and not fallback
+            if etag is None:
+                etag = await asyncio.to_thread(upload_etag, file.file)
+        else:
+            logger.info("💾 Response cache hit: %064x (distance %d)", fingerprint, distance)
+    
+    headers = etag_headers(etag) if etag is not None else None
+    
+    async def events():
+        if cached is not None:
+            classification = {k: v for k, v in cached.items() if k != "environmental_impact"}
+            classification["cached"] = True
+            yield orjson.dumps(classification) + b"\n"
+            if "environmental_impact" in cached:
+                yield orjson.dumps({"environmental_impact": cached["environmental_impact"]}) + b"\n"
+            return
         
-        print(f"\n📤 Sending response:")
-        print(json.dumps(result, indent=2))
-
-        return result
+        # If the client disconnects mid-stream the generator is closed early;
+        # don't leave a speculative educator call running unawaited
+        try:
+            yield orjson.dumps(result) + b"\n"
+            if not result["success"]:
+                if cacheable:
+                    response_cache[fingerprint] = result
+                return
+            
+            # Headers are already sent, so errors are reported in-band
+            try:
+                with log_request_errors():
+                    impact = await get_environmental_impact(result, metric_type, feedback)
+            except HTTPException as he:
+                yield orjson.dumps({"success": False, "detail": he.detail}) + b"\n"
+                return
+            yield orjson.dumps({"environmental_impact": impact}) + b"\n"
+            if cacheable:
+                response_cache[fingerprint] = {**result, "environmental_impact": impact}
+        finally:
+            if isinstance(feedback, asyncio.Task) and not feedback.done():
+                discard_task(feedback)
     
-    except HTTPException as he:
-        print(f"\n❌ HTTP Exception: {he.status_code} - {he.detail}")
-        print("="*60 + "\n")
-        raise he
-    except Exception as e:
-        print(f"\n❌ Unexpected error: {e}")
-        print(f"Traceback:\n{traceback.format_exc()}")
-        print("="*60 + "\n")
-        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+    return StreamingResponse(events(), media_type="application/x-ndjson", headers=headers)
 
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
+    
+    parser = argparse.ArgumentParser(description="GreenGuide backend server")
+    parser.add_argument(
+        "--log-level",
+        default=settings.LOG_LEVEL,
+        type=str.upper,
+        choices=LOG_LEVELS,
+        help="log level for the greenguide logger (default: LOG_LEVEL or INFO)"
+    )
+    app.state.log_level = parser.parse_args().log_level
+    
     print("\n" + "="*60)
     print("🌱 GREENGUIDE BACKEND SERVER v2.0")
     print("="*60)
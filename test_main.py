@@ -0,0 +1,60 @@
+from main import FingerprintCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def indexed_keys(cache):
+    return {key for index in cache._index for keys in index.values() for key in keys}
+
+
+def test_find_near_match():
+    cache = FingerprintCache(maxsize=10, ttl=60, max_distance=2, bits=64)
+    cache[0b1111_0000] = "a"
+
+    assert cache.find(0b1111_0000) == ("a", 0)
+    assert cache.find(0b1111_0011) == ("a", 2)
+    assert cache.find(0b1111_0111) == (None, None)
+
+
+def test_find_exact_only():
+    cache = FingerprintCache(maxsize=10, ttl=60, max_distance=0, bits=64)
+    cache[0b1111_0000] = "a"
+
+    assert cache.find(0b1111_0000) == ("a", 0)
+    assert cache.find(0b1111_0001) == (None, None)
+
+
+def test_eviction_unindexes():
+    cache = FingerprintCache(maxsize=2, ttl=60, max_distance=2, bits=64)
+    cache[0b0001] = "a"
+    cache[0xff00] = "b"
+    cache[0xf0f0] = "c"
+
+    assert cache.find(0b0001) == (None, None)
+    assert indexed_keys(cache) == {0xff00, 0xf0f0}
+
+
+def test_expiry_unindexes():
+    timer = FakeTimer()
+    cache = FingerprintCache(maxsize=10, ttl=60, max_distance=2, bits=64, timer=timer)
+    cache[0b1111_0000] = "a"
+    timer.now = 61
+
+    assert cache.find(0b1111_0001) == (None, None)
+    cache[0xff00] = "b"
+    assert indexed_keys(cache) == {0xff00}
+
+
+def test_clear_resets_index():
+    cache = FingerprintCache(maxsize=10, ttl=60, max_distance=2, bits=64)
+    cache[0b1111_0000] = "a"
+    cache.clear()
+
+    assert cache.find(0b1111_0000) == (None, None)
+    assert indexed_keys(cache) == set()